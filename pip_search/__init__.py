@@ -1,4 +1,4 @@
-from .pip_search import search
+from .pip_search import search, search_async
 #from .pip_search import utils
-__all__ = ['search', 'utils']
+__all__ = ['search', 'search_async', 'utils']
 __version__ = "0.0.13"
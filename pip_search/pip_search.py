@@ -1,20 +1,40 @@
+import asyncio
 import re
 import os
+import sys
 from loguru import logger
 from argparse import Namespace
-from dataclasses import InitVar, dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Generator, Union
+from pathlib import Path
+from typing import AsyncGenerator, Awaitable, Callable, Generator, Union
 from urllib.parse import urljoin
-import string
-import hashlib
 
-import requests
-from requests.auth import HTTPBasicAuth
-from bs4 import BeautifulSoup
+import hishel
+import httpx
+from bs4 import BeautifulSoup, SoupStrainer
+
+from .pow_solve import solve_pow
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # fall back to bs4
+    LexborHTMLParser = None
 
 DEBUG = False
 
+# The search pages and the PoW exchange are session bound and must never come from the cache
+NO_CACHE = {"cache_disabled": True}
+
+_SCRIPT_RE = re.compile(r"/(.*)/script.js")
+# TODO: make the pattern more robust
+_POW_RE = re.compile(
+    r'init\(\[\{"ty":"pow","data":\{"base":"(.+?)","hash":"(.+?)","hmac":"(.+?)","expires":"(.+?)"\}\}\], "(.+?)"'
+)
+
+# Only build the parts of the search pages we actually read
+SNIPPET_STRAINER = SoupStrainer("a", class_=re.compile("package-snippet"))
+
 class Config:
     """Configuration class"""
 
@@ -23,12 +43,25 @@ class Config:
     sort_by: str = "name"
     date_format: str = "%d-%-m-%Y"
     link_defualt_format: str = "https://pypi.org/project/{package.name}"
+    json_url_format: str = "https://pypi.org/pypi/{name}/json"
+    max_workers: int = 16
+    pow_length: int = 2
+    cache_dir: str = os.path.join(os.path.expanduser("~"), ".cache", "pip_search")
+    cache_ttl: int = 3600
 
 
 config = Config()
 
+if sys.version_info >= (3, 11):
+    # fromisoformat handles the "+0000" offsets pypi uses from 3.11 on and is much faster than strptime
+    _parse_released = datetime.fromisoformat
+else:
+    def _parse_released(released: str) -> datetime:
+        return datetime.strptime(released, "%Y-%m-%dT%H:%M:%S%z")
 
-@dataclass
+
+# slots drop the per instance __dict__, dataclass only generates them from python 3.10 on
+@dataclass(**({"slots": True} if sys.version_info >= (3, 10) else {}))
 class Package:
     """Package class"""
 
@@ -36,16 +69,17 @@ class Package:
     version: str
     released: str
     description: str
-    link: InitVar[str] = None
+    link: str = field(default=None, repr=False, compare=False)
+    released_date: datetime = field(init=False, repr=False, compare=False)
+    stars: int = field(init=False, default=0, repr=False, compare=False)
+    forks: int = field(init=False, default=0, repr=False, compare=False)
+    watchers: int = field(init=False, default=0, repr=False, compare=False)
+    github_link: str = field(init=False, default='', repr=False, compare=False)
+    info_set: bool = field(init=False, default=False, repr=False, compare=False)
 
-    def __post_init__(self, link: str = None):
-        self.link = link or config.link_defualt_format.format(package=self)
-        self.released_date = datetime.strptime(self.released, "%Y-%m-%dT%H:%M:%S%z")
-        self.stars: int = 0
-        self.forks: int = 0
-        self.watchers: int = 0
-        self.github_link: str = ''
-        self.info_set: bool = False
+    def __post_init__(self):
+        self.link = self.link or config.link_defualt_format.format(package=self)
+        self.released_date = _parse_released(self.released)
 
     def released_date_str(self, date_format: str = config.date_format) -> str:
         """Return the released date as a string formatted
@@ -63,48 +97,132 @@ class Package:
         self.github_link = info['github_link']
         self.info_set = True
 
-# todo add url to results
-def search(query: str, opts: Union[dict, Namespace] = {}) -> Generator[Package, None, None]:
-    """Search for packages matching the query
+def _snippet_fields(href: str, nodes, text: Callable, attr: Callable) -> tuple:
+    """Pick the snippet fields out of a single pass over the (tag, classes, node)
+    of its descendants, text(node) and attr(node, name) read the node values
 
-    Yields:
-        Package: package object
+    Returns:
+        tuple: (href, name, version, released, description)
     """
-    global DEBUG
-    if opts.debug: DEBUG = True
-    snippets = []
-    session = requests.Session()
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:133.0) Gecko/20100101 Firefox/133.0",
-    }
+    fields = {}
+    for tag, classes, node in nodes:
+        if tag == "time":
+            fields.setdefault("released", attr(node, "datetime"))
+            continue
+        for cls in classes:
+            if cls in ("package-snippet__name", "package-snippet__version", "package-snippet__description"):
+                fields.setdefault(cls[len("package-snippet__"):], text(node))
+    return (href, fields["name"], fields.get("version"), fields["released"], fields.get("description", ""))
+
+
+def _parse_snippets(html: str) -> list:
+    """Extract the raw fields of every search result snippet, walking each
+    snippet once instead of querying it per field
+
+    Returns:
+        list: (href, name, version, released, description) tuples,
+        version is None when the snippet doesn't show it
+    """
+    if LexborHTMLParser:
+        tree = LexborHTMLParser(html)
+        return [
+            _snippet_fields(
+                a.attributes.get("href"),
+                ((node.tag, (node.attributes.get("class") or "").split(), node) for node in a.traverse()),
+                lambda node: node.text(strip=True),
+                lambda node, name: node.attributes.get(name),
+            )
+            for a in tree.css("a.package-snippet")
+        ]
+    soup = BeautifulSoup(html, "lxml", parse_only=SNIPPET_STRAINER)
+    return [
+        _snippet_fields(
+            a.get("href"),
+            ((node.name, node.get("class") or [], node) for node in a.find_all(True)),
+            lambda node: node.text.strip(),
+            lambda node, name: node.get(name),
+        )
+        for a in soup.select('a[class*="package-snippet"]')
+    ]
+
+
+async def _fetch_metadata(name: str, session: httpx.AsyncClient) -> dict:
+    """Fetch the project metadata from the pypi JSON API
+
+    Returns:
+        dict: The "info" section of the metadata, empty if it can't be fetched
+    """
+    # a failing package must not abort the whole search, it just goes without metadata
+    try:
+        r = await session.get(config.json_url_format.format(name=name))
+    except httpx.HTTPError as e:
+        if DEBUG: logger.warning(f'[m] err:{e!r} name:{name} metadata request failed')
+        return {}
+    if r.status_code != 200:
+        if DEBUG: logger.warning(f'[m] {r.status_code} name:{name} metadata not found')
+        return {}
+    try:
+        return r.json().get('info') or {}
+    except (ValueError, AttributeError) as e:
+        if DEBUG: logger.warning(f'[m] err:{e!r} name:{name} invalid metadata')
+        return {}
+
+async def _fetch_package(item: tuple, session: httpx.AsyncClient) -> tuple:
+    """Build the Package for an (index, snippet) item, fetching its metadata
+    only when the snippet has no version
+
+    Returns:
+        tuple: (index, Package, metadata) where metadata is None if it wasn't fetched
+    """
+    index, (href, name, version, created, summary) = item
+    link = urljoin(config.api_url, href)
+    package = " ".join(name.split())
+
+    meta = None
+    if version:
+        version = " ".join(version.split())
+    else:
+        # Get version info from https://pypi.org/pypi/PACKAGE_NAME/json
+        meta = await _fetch_metadata(package, session)
+        version = meta.get('version') or "Unknown"
+
+    released = " ".join(created.split())
+    description = " ".join(summary.split())
+    pack = Package(package, version, released, description, link)
+    if DEBUG: logger.debug(pack)
+    return index, pack, meta
+
+async def _fetch_gh_info(item: tuple, session: httpx.AsyncClient, authparam) -> tuple:
+    """Add the github info to the Package of an (index, Package, metadata) item
+
+    Returns:
+        tuple: The same (index, Package, metadata) item
+    """
+    index, pack, meta = item
+    info = await get_github_info(pack.name, authparam, session, meta)
+    if info and info['set']:
+        pack.set_gh_info(info)
+        if DEBUG: logger.debug(f'[s] snippet {pack.name} link: {pack.link}')
+    return item
+
+async def _produce_snippets(query: str, session: httpx.AsyncClient, outbox: asyncio.Queue, downstream: int):
+    """Pass the search PoW and put the (index, snippet) of every search result in outbox,
+    followed by one None sentinel per downstream worker. index is the position
+    of the snippet across all pages, used to restore the search order"""
     params = {"q": query}
-    r = session.get(config.api_url, params=params, headers=headers)
+    r = await session.get(config.api_url, params=params, extensions=NO_CACHE)
 
     # Get script.js url
-    pattern = re.compile(r"/(.*)/script.js")
-    path = pattern.findall(r.text)[0]
+    path = _SCRIPT_RE.findall(r.text)[0]
     script_url = f"https://pypi.org/{path}/script.js"
 
-    r = session.get(script_url)
+    r = await session.get(script_url, extensions=NO_CACHE)
 
     # Find the PoW data from script.js
-    # TODO: make the pattern more robust
-    pattern = re.compile(
-        r'init\(\[\{"ty":"pow","data":\{"base":"(.+?)","hash":"(.+?)","hmac":"(.+?)","expires":"(.+?)"\}\}\], "(.+?)"'
-    )
-    base, hash, hmac, expires, token = pattern.findall(r.text)[0]
+    base, hash, hmac, expires, token = _POW_RE.findall(r.text)[0]
 
     # Compute the PoW answer
-    answer = ""
-    characters = string.ascii_letters + string.digits
-    for c1 in characters:
-        for c2 in characters:
-            c = base + c1 + c2
-            if hashlib.sha256(c.encode()).hexdigest() == hash:
-                answer = c1 + c2
-                break
-        if answer:
-            break
+    answer = solve_pow(base, hash, config.pow_length)
 
     # Send the PoW answer
     back_url = f"https://pypi.org/{path}/fst-post-back"
@@ -114,19 +232,61 @@ def search(query: str, opts: Union[dict, Namespace] = {}) -> Generator[Package,
             {"ty": "pow", "base": base, "answer": answer, "hmac": hmac, "expires": expires}
         ],
     }
-    r = session.post(back_url, json=data)
-
-    for page in range(1, config.page_size + 1):
-        params = {"q": query, "page": page}
-        r = session.get(config.api_url, params=params)
-        soup = BeautifulSoup(r.text, "html.parser")
-        snippets += soup.select('a[class*="package-snippet"]')
-        if DEBUG: logger.debug(f'[s] p:{page} snippets={len(snippets)} query={query} ')
+    r = await session.post(back_url, json=data, extensions=NO_CACHE)
+
+    # the result pages don't depend on each other, request them all at once
+    pages = range(1, config.page_size + 1)
+    responses = await asyncio.gather(*(
+        session.get(config.api_url, params={"q": query, "page": page}, extensions=NO_CACHE)
+        for page in pages
+    ))
+    count = 0
+    for page, r in zip(pages, responses):
+        snippets = _parse_snippets(r.text)
+        if DEBUG: logger.debug(f'[s] p:{page} snippets={count + len(snippets)} query={query} ')
+        for snippet in snippets:
+            await outbox.put((count, snippet))
+            count += 1
+    for _ in range(downstream):
+        await outbox.put(None)
+
+async def _worker(handler: Callable[..., Awaitable], inbox: asyncio.Queue, outbox: asyncio.Queue):
+    """Put handler(item) in outbox for every inbox item until a None sentinel"""
+    while True:
+        item = await inbox.get()
+        if item is None:
+            return
+        await outbox.put(await handler(item))
+
+async def _close_stage(workers: list, outbox: asyncio.Queue, downstream: int):
+    """Wait for the workers of a stage, then put one None sentinel per downstream worker in outbox"""
+    await asyncio.gather(*workers)
+    for _ in range(downstream):
+        await outbox.put(None)
+
+# todo add url to results
+async def search_async(query: str, opts: Union[dict, Namespace] = {}) -> AsyncGenerator[Package, None]:
+    """Search for packages matching the query
+
+    The search pages, project metadata and github info are fetched by
+    pipeline stages linked by bounded queues, so many requests are in
+    flight at once. Packages are yielded in search result order, each
+    one as soon as it and the ones before it are complete.
+
+    Yields:
+        Package: package object
+    """
+    global DEBUG
+    if opts.debug: DEBUG = True
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:133.0) Gecko/20100101 Firefox/133.0",
+    }
     authparam = None
     if opts.extra:
         GITHUBAPITOKEN = os.getenv('GITHUBAPITOKEN')
         GITHUB_USERNAME = os.getenv('GITHUB_USERNAME')
-        authparam = HTTPBasicAuth(GITHUB_USERNAME, GITHUBAPITOKEN)
+        if GITHUBAPITOKEN:
+            authparam = httpx.BasicAuth(GITHUB_USERNAME or '', GITHUBAPITOKEN)
 
     ## Below codes were moved to [__main__.py]
     # if "sort" in opts:
@@ -138,29 +298,81 @@ def search(query: str, opts: Union[dict, Namespace] = {}) -> Generator[Package,
     #     elif opts.sort == "released":
     #         snippets = sorted(snippets,key=lambda s: s.select_one('span[class*="package-snippet__created"]').find("time")["datetime"])
 
-    for snippet in snippets:
-        link = urljoin(config.api_url, snippet.get("href"))
-        package = re.sub(r"\s+", " ", snippet.select_one('span[class*="package-snippet__name"]').text.strip())
-
-        #version = re.sub(r"\s+"," ",snippet.select_one('span[class*="package-snippet__version"]').text.strip())
-        # Get version info from https://pypi.org/project/PACKAGE_NAME
-        response = session.get(link)
-        package_page = BeautifulSoup(response.text, "html.parser")
-        version_element = package_page.select_one('h1.package-header__name')
-        version = version_element.text.split()[-1] if version_element else "Unknown"
-
-        released = re.sub(r"\s+"," ",snippet.select_one('span[class*="package-snippet__created"]').find("time")["datetime"])
-        description = re.sub(r"\s+"," ",snippet.select_one('p[class*="package-snippet__description"]').text.strip())
-        pack = Package(package, version, released, description, link)
-        if DEBUG: logger.debug(pack)
+    # HTTP/2 multiplexes the worker requests over one connection per host,
+    # project pages and github responses are cached on disk following their cache headers
+    async with hishel.AsyncCacheClient(
+        http2=True,
+        headers=headers,
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=2 * config.max_workers),
+        storage=hishel.AsyncFileStorage(base_path=Path(config.cache_dir), ttl=config.cache_ttl),
+    ) as session:
+        # search pages -> package metadata -> github info (when extra) -> results
+        snippet_queue = asyncio.Queue(maxsize=config.max_workers)
+        gh_queue = asyncio.Queue(maxsize=config.max_workers)
+        results = asyncio.Queue()
+        stage_out = gh_queue if opts.extra else results
+        tasks = [asyncio.ensure_future(_produce_snippets(query, session, snippet_queue, config.max_workers))]
+        workers = [
+            asyncio.ensure_future(_worker(lambda snippet: _fetch_package(snippet, session), snippet_queue, stage_out))
+            for _ in range(config.max_workers)
+        ]
+        tasks += workers
+        tasks.append(asyncio.ensure_future(_close_stage(workers, stage_out, config.max_workers if opts.extra else 1)))
         if opts.extra:
-            info = get_github_info(link, authparam, session)
-            if info:
-                pack.set_gh_info(info)
-                if DEBUG: logger.debug(f'[s] snippet {s} / {len(snippets)} link: {link}')
-        yield pack  # Package(package, version, released, description, link, links)
+            workers = [
+                asyncio.ensure_future(_worker(lambda item: _fetch_gh_info(item, session, authparam), gh_queue, results))
+                for _ in range(config.max_workers)
+            ]
+            tasks += workers
+            tasks.append(asyncio.ensure_future(_close_stage(workers, results, 1)))
+
+        def _forward_error(task):
+            # surface a failing stage to the consumer instead of leaving it waiting forever
+            if not task.cancelled() and task.exception() is not None:
+                results.put_nowait(task.exception())
 
-def get_repo_info(repo, auth, session):
+        for task in tasks:
+            task.add_done_callback(_forward_error)
+        try:
+            # the stages finish packages out of order, hold them back until their turn
+            pending = {}
+            next_index = 0
+            while True:
+                item = await results.get()
+                if item is None:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                index, pack, _ = item
+                pending[index] = pack
+                while next_index in pending:
+                    yield pending.pop(next_index)
+                    next_index += 1
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+def search(query: str, opts: Union[dict, Namespace] = {}) -> Generator[Package, None, None]:
+    """Search for packages matching the query, see search_async
+
+    Yields:
+        Package: package object
+    """
+    loop = asyncio.new_event_loop()
+    packages = search_async(query, opts)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(packages.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(packages.aclose())
+        loop.close()
+
+async def get_repo_info(repo, auth, session):
     # info = {'stars':'', 'forks':'', 'watchers':'', 'set':False}
     info = {'stars':0, 'forks':0, 'watchers':0, 'set':False, 'github_link':''}
     try:
@@ -169,7 +381,11 @@ def get_repo_info(repo, auth, session):
         logger.error(f'[r] err:{e} repo:{repo}')
         return info
     apiurl = f'https://api.github.com/repos/{reponame}'
-    r = session.get(apiurl, auth=auth)
+    try:
+        r = await session.get(apiurl, auth=auth)
+    except httpx.HTTPError as e:
+        if DEBUG: logger.warning(f'[r] err:{e!r} repo:{repo} apiurl: {apiurl} request failed')
+        return info
     if DEBUG: logger.info(f'[r] repo:{repo} apiurl: {apiurl} r={r.status_code}')
     if r.status_code == 401:
         if DEBUG:
@@ -184,57 +400,39 @@ def get_repo_info(repo, auth, session):
             logger.warning(f'[r] {r.status_code} r: {reponame} apiurl: {apiurl} API rate limit exceeded')
         return info
     if r.status_code == 200:
+        j = None
         try:
-            info['stars'] = r.json().get("stargazers_count",0)  # str(r.json()["stargazers_count"])
-            info['forks'] = r.json().get("forks_count",0)
-            info['watchers'] = r.json().get("watchers_count",0)
+            j = r.json()
+            info['stars'] = j.get("stargazers_count",0)
+            info['forks'] = j.get("forks_count",0)
+            info['watchers'] = j.get("watchers_count",0)
             info['github_link'] = repo
             info['set'] = True
             return info
-        except (KeyError, TypeError, AttributeError) as err:
-            logger.error(f'[gri] {err} r:{r.status_code} apiurl:{apiurl} rj:{r.json()}')
+        except (KeyError, TypeError, AttributeError, ValueError) as err:
+            logger.error(f'[gri] {err} r:{r.status_code} apiurl:{apiurl} rj:{j}')
             logger.error(f'[gri] info:{info}')
             return info
 
-def get_github_info(repolink, authparam, session):
-    gh_link = None
-    gh_link = get_links(repolink, session)
+async def get_github_info(name, authparam, session, meta=None):
+    """Return the github repo info of a pypi project, meta is the already
+    fetched JSON API info (it is fetched for name otherwise)"""
+    if meta is None:
+        meta = await _fetch_metadata(name, session)
+    gh_link = get_links_from_json(meta, name)
     if gh_link:
-        info = get_repo_info(repo=gh_link['github'], auth=authparam, session=session)
+        info = await get_repo_info(repo=gh_link['github'], auth=authparam, session=session)
         return info
     else:
         return None
 
-def get_links(pkg_url, session):
-    # s = requests.session()
-    r = session.get(pkg_url)
-    soup = BeautifulSoup(r.text, "html.parser")
-    homepage = ''
-    githublink = ''
-    try:
-        # .vertical-tabs__tabs > div:nth-child(2) > ul:nth-child(2) > li:nth-child(2) > a:nth-child(1)
-        # '.vertical-tabs__tabs > div:nth-child(2) > ul:nth-child(2) > li:nth-child(1) > a:nth-child(1)'
-        csspath = '.vertical-tabs__tabs > div:nth-child(3) > ul:nth-child(4) > li:nth-child(1) > a:nth-child(1)'
-        homepage = soup.select_one(csspath,href=True).attrs['href']
-        if 'issues' in homepage:
-            homepage = soup.select_one('.vertical-tabs__tabs > div:nth-child(2) > ul:nth-child(2) > li:nth-child(2) > a:nth-child(1)',href=True).attrs['href']
-        if 'github' in homepage:
-            githublink = homepage
-            githublink = githublink.replace('/tags','')
-            return {'github':githublink, 'homepage':homepage}
-        else:
-            return None
-    except AttributeError as e:
-        # pass
-        logger.warning(f'[err] err:{e} homepage not found pkg_url:{pkg_url}')
-        return None
-    # try:
-    #     githublink = soup.select_one('.vertical-tabs__tabs > div:nth-child(2) > ul:nth-child(2) > li:nth-child(2) > a:nth-child(1)',href=True).attrs['href']
-    #     githublink = githublink.replace('/tags','')
-    #     return {'github':githublink, 'homepage':homepage}
-    # except AttributeError as e:
-    #     # pass
-    #     logger.warning(f'[err] err:{e} gh link not found pkg_url:{pkg_url} h:{homepage}')
-    # return {'github':githublink, 'homepage':homepage}
-
-
+def get_links_from_json(meta, name=None):
+    """Return the first github link of the project urls, or None"""
+    project_urls = meta.get('project_urls') or {}
+    # Source usually points at the repo itself, Homepage is the next best guess
+    urls = [project_urls.get('Source'), project_urls.get('Homepage'), *project_urls.values(), meta.get('home_page')]
+    for url in urls:
+        if url and 'github.com' in url and '/issues' not in url:
+            return {'github':url.replace('/tags',''), 'homepage':url}
+    if DEBUG: logger.debug(f'[l] no github link found name:{name}')
+    return None
@@ -0,0 +1,40 @@
+import hashlib
+import string
+
+POW_CHARACTERS = string.ascii_letters + string.digits
+
+
+def _sha256() -> "hashlib._Hash":
+    """Return a new sha256 object, skipping FIPS gating where supported"""
+    try:
+        return hashlib.new("sha256", usedforsecurity=False)
+    except TypeError:  # python < 3.9
+        return hashlib.sha256()
+
+
+def solve_pow(base: str, hash: str, length: int = 2) -> str:
+    """Brute force the length-char suffix whose sha256(base + suffix) matches hash
+
+    Returns:
+        str: The matching suffix, or an empty string if none was found
+    """
+    # every level copies its parent's midstate, so each prefix is hashed only once
+    charbytes = [bytes([ord(c)]) for c in POW_CHARACTERS]
+    target = bytes.fromhex(hash)
+
+    def _search(state, depth):
+        for i, b in enumerate(charbytes):
+            h = state.copy()
+            h.update(b)
+            if depth == 1:
+                if h.digest() == target:
+                    return POW_CHARACTERS[i]
+            else:
+                found = _search(h, depth - 1)
+                if found is not None:
+                    return POW_CHARACTERS[i] + found
+        return None
+
+    prefix = _sha256()
+    prefix.update(base.encode())
+    return _search(prefix, length) or ""
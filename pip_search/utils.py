@@ -2,7 +2,6 @@ from typing import Union
 import glob
 import os
 import requests
-from bs4 import BeautifulSoup
 
 try:
     from importlib.metadata import PackageNotFoundError, distribution
@@ -62,18 +61,18 @@ def get_local_libs(libpath):
     return name_list
 
 def check_pypi_version(libname):
-    baseurl = f'https://pypi.org/project/{libname}'
+    baseurl = f'https://pypi.org/pypi/{libname}/json'
     pkg_name = None
     pkg_version = None
     session = requests.Session()
     try:
         r = session.get(baseurl)
-        soup = BeautifulSoup(r.text, "html.parser")
-        # pkgheader = soup.select('h1[class*="package-header__name"]',limit=1)
-        pkgheader = soup.select('h1[class*="package-header__name"]',limit=1)
-        for p in pkgheader:
-            pkg_name,pkg_version = p.text.strip().split(' ')
-            return pkg_name, pkg_version
+        if r.status_code != 200:
+            # not on pypi, returning None puts the lib in check_local_libs' error list
+            return None
+        info = r.json()['info']
+        pkg_name, pkg_version = info['name'], info['version']
+        return pkg_name, pkg_version
     except Exception as e:
         print(f'error checking {libname}: {e} {type(e)}')
         return None, None
@@ -18,7 +18,8 @@ setup(
     long_description=README,
     long_description_content_type="text/markdown",
     packages=find_packages(exclude=("tests",)),
-    install_requires=["bs4", "loguru", "requests", "rich"],
+    install_requires=["bs4", "hishel<1.0", "httpx[http2]", "loguru", "lxml", "requests", "rich"],
+    extras_require={"fast": ["selectolax"]},
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
@@ -0,0 +1,35 @@
+import unittest
+from unittest import mock
+
+from pip_search import pip_search
+
+HTML = """
+<a class="package-snippet" href="/project/foo/">
+  <span class="package-snippet__name">foo</span>
+  <span class="package-snippet__version">1.2.3</span>
+  <span class="package-snippet__created"><time datetime="2023-01-02T03:04:05+0000">Jan 2, 2023</time></span>
+  <p class="package-snippet__description">A foo package</p>
+</a>
+<a class="package-snippet" href="/project/bar/">
+  <span class="package-snippet__name">bar</span>
+  <span class="package-snippet__created"><time datetime="2022-01-02T03:04:05+0000">Jan 2, 2022</time></span>
+</a>
+"""
+EXPECTED = [
+    ("/project/foo/", "foo", "1.2.3", "2023-01-02T03:04:05+0000", "A foo package"),
+    ("/project/bar/", "bar", None, "2022-01-02T03:04:05+0000", ""),
+]
+
+
+class TestParseSnippets(unittest.TestCase):
+    @unittest.skipUnless(pip_search.LexborHTMLParser, "selectolax is not installed")
+    def test_selectolax(self):
+        self.assertEqual(pip_search._parse_snippets(HTML), EXPECTED)
+
+    def test_bs4_fallback(self):
+        with mock.patch.object(pip_search, "LexborHTMLParser", None):
+            self.assertEqual(pip_search._parse_snippets(HTML), EXPECTED)
+
+
+if __name__ == "__main__":
+    unittest.main()
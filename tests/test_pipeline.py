@@ -0,0 +1,109 @@
+import asyncio
+import hashlib
+import json
+import unittest
+from argparse import Namespace
+from unittest import mock
+
+import httpx
+
+from pip_search import pip_search
+
+POW_BASE = "BASEXYZ"
+POW_ANSWER = "k9"
+SCRIPT = 'init([{"ty":"pow","data":{"base":"%s","hash":"%s","hmac":"hm","expires":"ex"}}], "tok")' % (
+    POW_BASE,
+    hashlib.sha256((POW_BASE + POW_ANSWER).encode()).hexdigest(),
+)
+PER_PAGE = 20
+
+
+def snippet_html(index):
+    # every third snippet has no version, so it goes through the metadata fetch
+    version = "" if index % 3 == 0 else f'<span class="package-snippet__version">1.{index}</span>'
+    return (
+        f'<a class="package-snippet" href="/project/p{index}/">'
+        f'<span class="package-snippet__name">p{index}</span>{version}'
+        '<span class="package-snippet__created"><time datetime="2023-01-02T03:04:05+0000">x</time></span>'
+        f'<p class="package-snippet__description">package {index}</p></a>'
+    )
+
+
+class MockPypi:
+    """Fake pypi.org / api.github.com, later results answer faster"""
+
+    def __init__(self, fail_paths=()):
+        self.fail_paths = fail_paths
+        self.total = PER_PAGE * pip_search.config.page_size
+
+    async def __call__(self, request):
+        url = request.url
+        if url.path in self.fail_paths:
+            raise httpx.ConnectError("boom", request=request)
+        if url.path == "/search/" and "page" not in url.params:
+            return httpx.Response(200, text='<script src="/abc/def/script.js"></script>')
+        if url.path.endswith("script.js"):
+            return httpx.Response(200, text=SCRIPT)
+        if url.path.endswith("fst-post-back"):
+            assert json.loads(request.content)["data"][0]["answer"] == POW_ANSWER
+            return httpx.Response(200)
+        if url.path == "/search/":
+            page = int(url.params["page"])
+            indexes = range((page - 1) * PER_PAGE, page * PER_PAGE)
+            return httpx.Response(200, text="".join(snippet_html(i) for i in indexes))
+        if url.path.startswith("/pypi/"):
+            index = int(url.path.split("/")[2][1:])
+            await asyncio.sleep((self.total - index) * 0.001)
+            return httpx.Response(200, json={"info": {
+                "version": f"9.{index}",
+                "project_urls": {"Source": f"https://github.com/x/p{index}"},
+            }})
+        if url.host == "api.github.com":
+            index = int(url.path.split("/")[-1][1:])
+            await asyncio.sleep((self.total - index) * 0.001)
+            return httpx.Response(200, json={"stargazers_count": index, "forks_count": 0, "watchers_count": 0})
+        return httpx.Response(404)
+
+
+class TestSearchPipeline(unittest.TestCase):
+    def run_search(self, extra, fail_paths=()):
+        transport = httpx.MockTransport(MockPypi(fail_paths))
+
+        def client(**kwargs):
+            kwargs.pop("storage")
+            kwargs.pop("http2")
+            return httpx.AsyncClient(transport=transport, **kwargs)
+
+        with mock.patch.object(pip_search.hishel, "AsyncCacheClient", client), \
+                mock.patch.object(pip_search.hishel, "AsyncFileStorage", lambda **kwargs: None):
+            return list(pip_search.search("p", Namespace(debug=False, extra=extra)))
+
+    def test_keeps_search_order(self):
+        packages = self.run_search(extra=False)
+        total = PER_PAGE * pip_search.config.page_size
+        self.assertEqual([p.name for p in packages], [f"p{i}" for i in range(total)])
+        self.assertEqual(packages[0].version, "9.0")
+        self.assertEqual(packages[1].version, "1.1")
+        self.assertFalse(any(p.info_set for p in packages))
+
+    def test_keeps_search_order_with_extra(self):
+        packages = self.run_search(extra=True)
+        total = PER_PAGE * pip_search.config.page_size
+        self.assertEqual([p.name for p in packages], [f"p{i}" for i in range(total)])
+        self.assertEqual([p.stars for p in packages], list(range(total)))
+        self.assertTrue(all(p.info_set for p in packages))
+
+    def test_failing_stage_reaches_caller(self):
+        with self.assertRaises(httpx.ConnectError):
+            self.run_search(extra=True, fail_paths={"/abc/def/script.js"})
+
+    def test_failing_package_request_is_skipped(self):
+        packages = self.run_search(extra=True, fail_paths={"/pypi/p0/json", "/repos/x/p1"})
+        self.assertEqual(len(packages), PER_PAGE * pip_search.config.page_size)
+        self.assertEqual((packages[0].version, packages[0].info_set), ("Unknown", False))
+        self.assertEqual((packages[1].version, packages[1].info_set), ("1.1", False))
+        self.assertTrue(all(p.info_set for p in packages[2:]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+from unittest import mock
+
+from pip_search import utils
+
+
+class TestCheckLocalLibs(unittest.TestCase):
+    def check(self, status_code, payload):
+        response = mock.Mock(status_code=status_code)
+        response.json.return_value = payload
+        libs = [{"name": "lib", "version": "1.0", "distpath": "/x"}]
+        with mock.patch.object(utils, "get_local_libs", return_value=libs), \
+                mock.patch.object(utils.requests.Session, "get", return_value=response):
+            return utils.check_local_libs("/x")
+
+    def test_outdated(self):
+        self.assertEqual(self.check(200, {"info": {"name": "lib", "version": "2.0"}}), (["lib"], []))
+
+    def test_up_to_date(self):
+        self.assertEqual(self.check(200, {"info": {"name": "lib", "version": "1.0"}}), ([], []))
+
+    def test_missing_from_pypi_is_an_error(self):
+        outdated, errors = self.check(404, {"message": "Not Found"})
+        self.assertEqual(outdated, [])
+        self.assertEqual([lib["name"] for lib in errors], ["lib"])
+
+
+if __name__ == "__main__":
+    unittest.main()